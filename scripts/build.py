@@ -65,7 +65,20 @@ class logfile_writer_proxy(object):
         else:
             self._writer.write(full)
 
-def runcmdAndGetData(exe, args=[], verbose=False, outputStdErr=False, outputStdOut=False, stdin=None, stdout=None, stderr=None, input=None, cwd=None, env=None, shell=False):
+def _wait_process(p, rusage=None):
+    # os.wait4 returns the resource usage of the child and all its waited-for
+    # descendants, so ru_maxrss is the peak of the largest compiler process.
+    if rusage is not None and hasattr(os, 'wait4'):
+        (pid, status, usage) = os.wait4(p.pid, 0)
+        if os.WIFSIGNALED(status):
+            p.returncode = -os.WTERMSIG(status)
+        else:
+            p.returncode = os.WEXITSTATUS(status)
+        rusage.append(usage)
+        return p.returncode
+    return p.wait()
+
+def runcmdAndGetData(exe, args=[], verbose=False, outputStdErr=False, outputStdOut=False, stdin=None, stdout=None, stderr=None, input=None, cwd=None, env=None, shell=False, rusage=None):
     all_args = [str(exe)]
     all_args.extend(args)
     if verbose:
@@ -107,7 +120,7 @@ def runcmdAndGetData(exe, args=[], verbose=False, outputStdErr=False, outputStdO
             while True:
                 if not _read_line_from_handle(p.stdout, stdout, encoding):
                     break
-            sts = p.wait()
+            sts = _wait_process(p, rusage)
             stdoutdata = None
             stderrdata = None
         else:
@@ -173,6 +186,7 @@ class osg_env_build(object):
         #self._cmake_install_prefix = ''
         self._cmake_install_prefix = None
         self._cmake_build_type = 'Debug'
+        self._active_profiles = {}
 
         self._submodules = {
             'OpenSceneGraph': {
@@ -187,6 +201,9 @@ class osg_env_build(object):
                 self.only_win32('-DPNG_PNG_INCLUDE_DIR=$THIRDPARTY_gdal_DIR/include'),
                 self.only_win32('-DPNG_LIBRARY=$THIRDPARTY_gdal_DIR/lib/libpng.lib')
                 ],
+                'Profiles': {
+                    'unity': ['-DCMAKE_UNITY_BUILD=ON', '-DCMAKE_UNITY_BUILD_BATCH_SIZE=16'],
+                    },
                 'links': self._links_osg,
                 },
             'VulkanSceneGraph': {
@@ -200,6 +217,9 @@ class osg_env_build(object):
                 self.only_win32('-DPNG_PNG_INCLUDE_DIR=$THIRDPARTY_gdal_DIR/include'),
                 self.only_win32('-DPNG_LIBRARY=$THIRDPARTY_gdal_DIR/lib/libpng.lib')
                 ],
+                'Profiles': {
+                    'unity': ['-DCMAKE_UNITY_BUILD=ON', '-DCMAKE_UNITY_BUILD_BATCH_SIZE=16'],
+                    },
                 'links': self._links_vsg,
                 },
             'vsgQt': {
@@ -222,6 +242,12 @@ class osg_env_build(object):
                     self.only_win32('-DCURL_INCLUDE_DIR=$THIRDPARTY_gdal_DIR/include'),
                     self.only_win32('-DCURL_LIBRARY=$THIRDPARTY_gdal_DIR/lib/libcurl_imp.lib'),
                     ],
+                'Profiles': {
+                    'unity': ['-DCMAKE_UNITY_BUILD=ON', '-DCMAKE_UNITY_BUILD_BATCH_SIZE=8'],
+                    'pch': ['--pch:<vector>', '--pch:<string>', '--pch:<map>',
+                            '--pch:<osg/Node>', '--pch:<osg/Group>', '--pch:<osg/Geometry>',
+                            '--pch:<osg/StateSet>', '--pch:<osg/Texture2D>', '--pch:<osgDB/ReadFile>'],
+                    },
                 'links': self._links_osgearth,
                 },
             'sgi': {
@@ -229,6 +255,9 @@ class osg_env_build(object):
                 'Dev': True,
                 'CMake': ['-DOSG_DIR=$OpenSceneGraph_SOURCE_DIR;$OpenSceneGraph_BUILD_DIR',
                           '-DOSGEARTH_DIR=$osgearth_SOURCE_DIR;$osgearth_BUILD_DIR'],
+                'Profiles': {
+                    'pch': ['--pch:<osg/Node>', '--pch:<osg/Group>', '--pch:<osgDB/ReadFile>'],
+                    },
                 'links': self._links_sgi,
                 },
             }
@@ -364,9 +393,155 @@ class osg_env_build(object):
             submod_build = submod_opts.get('Build', True)
             submod_dev = submod_opts.get('Dev', False)
             if submod_build:
-                if not self._run_cmake(submod_source_dir, submod_build_dir, opts=submod_opts['CMake'], build=build, install=True if install and not submod_dev else False):
+                profiles = self._active_profiles.get(submod, [])
+                opts = submod_opts['CMake'] + self._profile_opts(submod_opts, profiles)
+                profiles_file = os.path.join(submod_build_dir, 'osg-env-profiles.txt')
+                profiles_changed = self._read_profiles_file(profiles_file) != sorted(profiles)
+                if profiles:
+                    self.log('Module %s profiles: %s' % (submod, ','.join(profiles)))
+                if not self._run_cmake(submod_source_dir, submod_build_dir, opts=opts, build=build, install=True if install and not submod_dev else False, force=profiles_changed):
                     ret = False
                     break
+                self._write_profiles_file(profiles_file, profiles)
+        return ret
+
+    def _read_profiles_file(self, filename):
+        if not os.path.isfile(filename):
+            return []
+        with open(filename, 'r') as f:
+            return sorted([l.strip() for l in f.readlines() if l.strip()])
+
+    def _write_profiles_file(self, filename, profiles):
+        with open(filename, 'w') as f:
+            for p in sorted(profiles):
+                f.write(p + '\n')
+
+    def _profile_cache_var(self, opt):
+        if opt.startswith('--pch:'):
+            return 'CMAKE_PROJECT_INCLUDE'
+        m = re.match(r'-D([^:=]+)', opt)
+        return m.group(1) if m else None
+
+    def _profile_opts(self, submod_opts, profiles):
+        # Options of the active profiles are passed as is. Cache variables set
+        # by inactive profiles are removed with -U, so switching a profile off
+        # does not leave a stale value in an existing CMakeCache.txt.
+        opts = []
+        unset = []
+        for name, profile_opts in sorted(submod_opts.get('Profiles', {}).items()):
+            for o in profile_opts:
+                if o is None:
+                    continue
+                if name in profiles:
+                    opts.append(o)
+                else:
+                    var = self._profile_cache_var(o)
+                    if var and var not in unset:
+                        unset.append(var)
+        active_vars = [self._profile_cache_var(o) for o in opts]
+        for var in unset:
+            if var not in active_vars:
+                opts.append('-U%s' % var)
+        return opts
+
+    def _write_pch_script(self, build_dir, headers):
+        # CMAKE_PROJECT_INCLUDE is read after every project() call; the actual
+        # work is deferred until the top-level directory is fully processed so
+        # all targets of the module exist (requires CMake 3.19).
+        # The headers are C++ only, so they are wrapped in a COMPILE_LANGUAGE
+        # generator expression to keep C sources of the same target building.
+        cxx_headers = []
+        for h in headers:
+            cxx_headers.append('"$<$<COMPILE_LANGUAGE:CXX>:%s>"' % h.replace('>', '$<ANGLE-R>'))
+        filename = os.path.join(build_dir, 'osg-env-pch.cmake')
+        with open(filename, 'w') as f:
+            f.write('# generated by %s\n' % os.path.basename(script_file))
+            f.write('if(CMAKE_VERSION VERSION_LESS 3.19)\n')
+            f.write('    message(FATAL_ERROR "The pch profile requires CMake 3.19 or newer (found ${CMAKE_VERSION})")\n')
+            f.write('endif()\n')
+            f.write('get_property(_osg_env_pch_deferred GLOBAL PROPERTY OSG_ENV_PCH_DEFERRED)\n')
+            f.write('if(NOT _osg_env_pch_deferred)\n')
+            f.write('    set_property(GLOBAL PROPERTY OSG_ENV_PCH_DEFERRED TRUE)\n')
+            f.write('    function(osg_env_apply_pch dir)\n')
+            f.write('        get_property(_targets DIRECTORY ${dir} PROPERTY BUILDSYSTEM_TARGETS)\n')
+            f.write('        foreach(_target IN LISTS _targets)\n')
+            f.write('            get_target_property(_type ${_target} TYPE)\n')
+            f.write('            if(_type MATCHES "^(STATIC_LIBRARY|SHARED_LIBRARY|MODULE_LIBRARY|OBJECT_LIBRARY|EXECUTABLE)$")\n')
+            f.write('                target_precompile_headers(${_target} PRIVATE %s)\n' % ' '.join(cxx_headers))
+            f.write('            endif()\n')
+            f.write('        endforeach()\n')
+            f.write('        get_property(_subdirs DIRECTORY ${dir} PROPERTY SUBDIRECTORIES)\n')
+            f.write('        foreach(_subdir IN LISTS _subdirs)\n')
+            f.write('            osg_env_apply_pch(${_subdir})\n')
+            f.write('        endforeach()\n')
+            f.write('    endfunction()\n')
+            f.write('    cmake_language(DEFER DIRECTORY ${CMAKE_SOURCE_DIR} CALL osg_env_apply_pch ${CMAKE_SOURCE_DIR})\n')
+            f.write('endif()\n')
+        return filename
+
+    def _object_size(self, build_dir):
+        total = 0
+        for root, dirs, files in os.walk(build_dir):
+            for f in files:
+                if f.endswith('.o') or f.endswith('.obj'):
+                    total += os.path.getsize(os.path.join(root, f))
+        return total
+
+    def _format_size(self, size):
+        if size is None:
+            return 'n/a'
+        for unit in ['B', 'KiB', 'MiB']:
+            if size < 1024:
+                return '%.1f %s' % (size, unit)
+            size /= 1024.0
+        return '%.1f GiB' % size
+
+    def _format_delta(self, a, b):
+        if a is None or b is None or not a:
+            return 'n/a'
+        return '%+.1f%%' % ((b - a) * 100.0 / a)
+
+    def _ab_compare(self, profile):
+        ret = True
+        for submod, submod_opts in self._submodules.items():
+            if submod not in self._selected_submodules:
+                self.log('Skip module %s' % submod)
+                continue
+            if profile not in submod_opts.get('Profiles', {}):
+                self.log('Skip module %s (no profile %s)' % (submod, profile))
+                continue
+
+            submod_source_dir = os.path.join(self._source_dir, submod)
+            # profiles enabled with -p apply to both variants
+            base_profiles = [p for p in self._active_profiles.get(submod, []) if p != profile]
+            if base_profiles:
+                self.log('A/B baseline profiles for %s: %s' % (submod, ','.join(base_profiles)))
+            results = []
+            for variant, profiles in [('baseline', base_profiles), (profile, base_profiles + [profile])]:
+                # always build from scratch so both variants pay the full cost
+                ab_build_dir = os.path.join(self._build_dir, 'ab', submod, variant)
+                self._rmdir(ab_build_dir)
+                self._mkpath(ab_build_dir)
+                self.log('A/B build %s (%s) in %s' % (submod, variant, ab_build_dir))
+                stats = {}
+                opts = submod_opts['CMake'] + self._profile_opts(submod_opts, profiles)
+                if not self._run_cmake(submod_source_dir, ab_build_dir, opts=opts, build=True, install=False, force=True, stats=stats):
+                    ret = False
+                    break
+                stats['object_size'] = self._object_size(ab_build_dir)
+                results.append(stats)
+            if not ret:
+                break
+
+            (a, b) = results
+            self.log('A/B result for %s, profile %s:' % (submod, profile))
+            self.log('   %-16s %-16s %-16s %s' % ('', 'baseline', profile, 'delta'))
+            for key, label in [('configure_time', 'configure time'), ('build_time', 'build time')]:
+                self.log('   %-16s %-16s %-16s %s' % (label, a[key], b[key],
+                         self._format_delta(a[key].total_seconds(), b[key].total_seconds())))
+            for key, label in [('build_maxrss', 'peak memory'), ('object_size', 'object size')]:
+                self.log('   %-16s %-16s %-16s %s' % (label, self._format_size(a.get(key)), self._format_size(b.get(key)),
+                         self._format_delta(a.get(key), b.get(key))))
         return ret
 
     def _get_build_environment(self, use_os_environ=True):
@@ -391,7 +566,7 @@ class osg_env_build(object):
             s = s.replace(k, v)
         return s
 
-    def _run_cmake(self, source_dir, build_dir, opts, build=True, install=True):
+    def _run_cmake(self, source_dir, build_dir, opts, build=True, install=True, force=False, stats=None):
 
         cmake_stdout = logfile_writer_proxy(self._logfile_handle)
         cmake_stderr = subprocess.STDOUT
@@ -404,7 +579,7 @@ class osg_env_build(object):
         cmake_env = self._get_build_environment()
         cmake_cache_txt = os.path.join(build_dir, 'CMakeCache.txt')
         makefile = os.path.join(build_dir, 'Makefile')
-        if not os.path.isfile(cmake_cache_txt) or not os.path.isfile(makefile) or self._force:
+        if not os.path.isfile(cmake_cache_txt) or not os.path.isfile(makefile) or self._force or force:
             self.log('CMake generator: %s' % (self._cmake_generator))
             self.log('CMake build type: %s' % (self._cmake_build_type))
             self.log('CMake install prefix: %s' % (self._cmake_install_prefix))
@@ -414,6 +589,7 @@ class osg_env_build(object):
             cmake_opts.append('-DCMAKE_BUILD_TYPE=%s' % self._cmake_build_type)
 
             cmake_module_path = []
+            pch_headers = []
 
             if self._cmake_definitions:
                 for k,v in self._cmake_definitions.items():
@@ -429,10 +605,14 @@ class osg_env_build(object):
                         mod = self._expand_vars(o[9:])
                         print('add module %s' % mod)
                         cmake_module_path.append(mod)
+                    elif o.startswith('--pch:'):
+                        pch_headers.append(self._expand_vars(o[6:]))
                     else:
                         cmake_opts.append(self._expand_vars(o))
 
             cmake_opts.append('-DCMAKE_MODULE_PATH=%s' % ';'.join(cmake_module_path))
+            if pch_headers:
+                cmake_opts.append('-DCMAKE_PROJECT_INCLUDE=%s' % self._write_pch_script(build_dir, pch_headers))
             cmake_opts.append(source_dir)
 
             self.log('CMake defines:')
@@ -450,6 +630,8 @@ class osg_env_build(object):
 
             if ret:
                 self.log('CMake configuration successful in %s' % (self._cmake_time))
+                if stats is not None:
+                    stats['configure_time'] = self._cmake_time
             else:
                 self.error('CMake configuration failed with status %i in %s' % (cmake_exitcode, self._cmake_time))
 
@@ -464,9 +646,10 @@ class osg_env_build(object):
                 cmake_opts.append('--')
                 cmake_opts.append('-j4')
 
+            rusage = [] if stats is not None else None
             self._cmake_start_timestamp = time()
             self.log('CMake build:')
-            (cmake_exitcode, stdout, stderr) = runcmdAndGetData(self._cmake_executable, cmake_opts, env=cmake_env, cwd=build_dir, stdout=cmake_stdout, stderr=cmake_stderr, verbose=self._verbose)
+            (cmake_exitcode, stdout, stderr) = runcmdAndGetData(self._cmake_executable, cmake_opts, env=cmake_env, cwd=build_dir, stdout=cmake_stdout, stderr=cmake_stderr, verbose=self._verbose, rusage=rusage)
             ret = True if cmake_exitcode == 0 else False
 
             self._cmake_end_timestamp = time()
@@ -474,6 +657,12 @@ class osg_env_build(object):
 
             if ret:
                 self.log('CMake build successful in %s' % (self._cmake_time))
+                if stats is not None:
+                    stats['build_time'] = self._cmake_time
+                    if rusage:
+                        # ru_maxrss is reported in bytes on macOS and in KiB elsewhere
+                        maxrss = rusage[0].ru_maxrss
+                        stats['build_maxrss'] = maxrss if platform.system() == 'Darwin' else maxrss * 1024
             else:
                 self.error('CMake build failed with status %i in %s' % (cmake_exitcode, self._cmake_time))
 
@@ -576,6 +765,15 @@ class osg_env_build(object):
 
         pass
 
+    def _find_submodule(self, name):
+        for sk, sv in self._submodules.items():
+            if sk.lower() == name.lower():
+                return sk
+            for a in sv.get('alias', []):
+                if a.lower() == name.lower():
+                    return sk
+        return None
+
     def main(self):
         #=============================================================================================
         # process command line
@@ -587,9 +785,18 @@ class osg_env_build(object):
         parser.add_argument('--logfile', dest='logfile', help='override the logfile')
         parser.add_argument('-f', '--force', dest='force', action='store_true', help='force to run CMake for each submodules')
         parser.add_argument('-n', '--no-build', dest='build', action='store_false', help='disable building of modules')
+        parser.add_argument('-p', '--profile', dest='profile', action='append', metavar='[MODULE:]PROFILE', help='enable a build acceleration profile for all selected modules providing it or only for the given module')
+        parser.add_argument('--ab', dest='ab_profile', metavar='PROFILE', help='build the selected modules with and without the given profile in scratch build directories and compare build time, peak memory and object size; profiles enabled with -p are used for both builds')
+        parser.add_argument('--list-profiles', dest='list_profiles', action='store_true', help='list the build acceleration profiles of each module')
         parser.add_argument('submodule', nargs='*', help='override the logfile')
         args = parser.parse_args()
 
+        if args.list_profiles:
+            for sk, sv in self._submodules.items():
+                for name, profile_opts in sorted(sv.get('Profiles', {}).items()):
+                    print('%s:%s %s' % (sk, name, ' '.join([o for o in profile_opts if o is not None])))
+            return 0
+
         self._verbose = args.verbose
         self._force = args.force
         self._logfile = args.logfile
@@ -623,27 +830,48 @@ class osg_env_build(object):
         else:
             self._selected_submodules = []
             for s in args.submodule:
-                found = False
-                for sk, sv in self._submodules.items():
-                    if sk.lower() == s.lower():
-                        self._selected_submodules.append(sk)
-                        found = True
-                        break
-                    else:
-                        for a in sv.get('alias', []):
-                            if a.lower() == s.lower():
-                                self._selected_submodules.append(sk)
-                                found = True
-                                break
-
-                if not found:
+                sk = self._find_submodule(s)
+                if sk is None:
                     self.error('Unknown submodule %s (available submodule %s)' % (s, ','.join(self._submodules.keys())))
                     return 2
+                self._selected_submodules.append(sk)
+
+        self._active_profiles = {}
+        for p in args.profile or []:
+            if ':' in p:
+                (s, name) = p.split(':', 1)
+                sk = self._find_submodule(s)
+                if sk is None:
+                    self.error('Unknown submodule %s (available submodule %s)' % (s, ','.join(self._submodules.keys())))
+                    return 2
+                if name not in self._submodules[sk].get('Profiles', {}):
+                    self.error('Unknown profile %s for submodule %s (available profiles %s)' % (name, sk, ','.join(self._submodules[sk].get('Profiles', {}).keys())))
+                    return 2
+                targets = [sk]
+            else:
+                name = p
+                targets = [sk for sk in self._selected_submodules if name in self._submodules[sk].get('Profiles', {})]
+                if not targets:
+                    self.error('Unknown profile %s for the selected submodules' % name)
+                    return 2
+            for sk in targets:
+                profiles = self._active_profiles.setdefault(sk, [])
+                if name not in profiles:
+                    profiles.append(name)
+
+        if args.ab_profile:
+            if not [sk for sk in self._selected_submodules if args.ab_profile in self._submodules[sk].get('Profiles', {})]:
+                self.error('Unknown profile %s for the selected submodules' % args.ab_profile)
+                return 2
 
         self.log('Submodules: %s' % ','.join(self._selected_submodules))
         self._create_build_dir()
         self._prepare_vars()
-        if not self._configure_and_build(build=args.build):
+        if args.ab_profile:
+            if not self._ab_compare(args.ab_profile):
+                self.error('A/B build failed')
+                return 1
+        elif not self._configure_and_build(build=args.build):
             self.error('Configure/Build failed')
             return 1
 